@@ -44,7 +44,7 @@ class LeuvenArmModel:
         self.sensory_noise_magnitude = sensory_noise_magnitude
         self.sensory_reference = sensory_reference
 
-        self.compute_torques_from_noise_and_feedback = (compute_torques_from_noise_and_feedback,)
+        self.compute_torques_from_noise_and_feedback = compute_torques_from_noise_and_feedback
 
         n_noised_controls = 6
         n_references = 4
@@ -1,5 +1,25 @@
-from typing import Callable, Any
-from casadi import MX_eye, SX_eye, jacobian, Function, MX, SX, vertcat
+import hashlib
+import os
+import subprocess
+import tempfile
+from warnings import warn
+from typing import Callable, Any, Final
+from casadi import (
+    MX_eye,
+    SX_eye,
+    jacobian,
+    Function,
+    MX,
+    SX,
+    vertcat,
+    horzcat,
+    reshape,
+    sum2,
+    vec,
+    CodeGenerator,
+    external,
+)
+import numpy as np
 
 from .constraints import PenaltyOption
 from .objective_functions import ObjectiveFunction
@@ -8,9 +28,12 @@ from ..limits.penalty_helpers import PenaltyHelpers
 from ..misc.enums import Node, PenaltyType
 from ..misc.fcn_enum import FcnEnum
 from ..misc.options import UniquePerPhaseOptionList
-from ..misc.mapping import BiMapping
+from ..misc.mapping import BiMapping, Mapping
 from ..models.protocols.stochastic_biomodel import StochasticBioModel
 
+# The Node a multinode penalty can be applied on
+_ALLOWED_MULTINODE_NODES: Final = frozenset({Node.START, Node.MID, Node.PENULTIMATE, Node.END})
+
 
 class MultinodePenalty(PenaltyOption):
     """
@@ -34,6 +57,9 @@ class MultinodePenalty(PenaltyOption):
         The nature of the cost function is the binode penalty
     penalty_type: PenaltyType
         If the penalty is from the user or from bioptim (implicit or internal)
+    jit: bool
+        If the casadi functions of the penalty should be jit compiled. This is ignored (with a warning) if the ocp
+        uses SX or if the penalty is expanded, since the compiled functions would be inlined
     """
 
     def __init__(
@@ -43,6 +69,7 @@ class MultinodePenalty(PenaltyOption):
         nodes_phase: tuple[int, ...],
         multinode_penalty: Any | Callable = None,
         custom_function: Callable = None,
+        jit: bool = False,
         **params: Any,
     ):
         if not isinstance(multinode_penalty, _multinode_penalty_fcn):
@@ -52,12 +79,11 @@ class MultinodePenalty(PenaltyOption):
         super(MultinodePenalty, self).__init__(penalty=multinode_penalty, custom_function=custom_function, **params)
 
         for node in nodes:
-            if node not in (Node.START, Node.MID, Node.PENULTIMATE, Node.END):
-                if not isinstance(node, int):
-                    raise ValueError(
-                        "Multinode penalties only works with Node.START, Node.MID, "
-                        "Node.PENULTIMATE, Node.END or a node index (int)."
-                    )
+            if not (isinstance(node, int) or (isinstance(node, Node) and node in _ALLOWED_MULTINODE_NODES)):
+                raise ValueError(
+                    "Multinode penalties only works with Node.START, Node.MID, "
+                    "Node.PENULTIMATE, Node.END or a node index (int)."
+                )
         for phase in nodes_phase:
             if not isinstance(phase, int):
                 raise ValueError("nodes_phase should be all positive integers corresponding to the phase index")
@@ -74,6 +100,7 @@ class MultinodePenalty(PenaltyOption):
         self.node_idx = [0]
         self.all_nodes_index = []  # This is filled when nodes are collapsed as actual time indices
         self.penalty_type = PenaltyType.INTERNAL
+        self.jit = jit
 
         self.phase_dynamics = []  # This is set in _prepare_controller_cx
         self.ns = []  # This is set in _prepare_controller_cx
@@ -100,16 +127,36 @@ class MultinodePenalty(PenaltyOption):
                 pool.append([])
                 self.list_index = len(pool) - 1
         else:
-            while self.list_index >= len(pool):
-                pool.append([])
+            pool.extend([] for _ in range(self.list_index + 1 - len(pool)))
             pool[self.list_index] = []
 
 
 class MultinodePenaltyFunctions(PenaltyFunctionAbstract):
     """
     Internal implementation of the phase transitions
+
+    Attributes
+    ----------
+    jit_options: dict
+        The casadi Function options used when a penalty is declared with jit=True
+    use_sx: bool
+        If the equality penalties should be evaluated through an SX Function (even if the ocp uses MX)
+    codegen_directory: str
+        If set, the Functions of the penalties declared with jit=True are generated as C code and compiled in this
+        directory instead of being jit compiled. The libraries are named after the content of the Function, so they
+        are compiled once and reused across the runs
+    codegen_compiler: str
+        The compiler used to build the libraries in codegen_directory
+
+    These attributes are read on the Functions class of the penalty (e.g. MultinodeConstraintFunctions or
+    MultinodeObjectiveFunctions), so they can be set on a child class to only affect its penalties
     """
 
+    jit_options = {"jit": True, "compiler": "shell", "jit_options": {"flags": ["-O3"], "verbose": False}}
+    use_sx = True
+    codegen_directory = None
+    codegen_compiler = "gcc"
+
     class Functions:
         """
         Implementation of all the Multinode Constraint
@@ -147,12 +194,16 @@ class MultinodePenaltyFunctions(PenaltyFunctionAbstract):
             states_mapping = MultinodePenaltyFunctions.Functions._prepare_states_mapping(controllers, states_mapping)
 
             ctrl_0 = controllers[0]
-            states_0 = states_mapping[0].to_second.map(ctrl_0.states[key].cx)
-            out = ctrl_0.cx.zeros(states_0.shape)
-            for i in range(1, len(controllers)):
-                ctrl_i = controllers[i]
-                states_i = states_mapping[i - 1].to_first.map(ctrl_i.states[key].cx)
-
+            states_0 = MultinodePenaltyFunctions.Functions._apply_mapping(
+                states_mapping[0].to_second, ctrl_0.states[key].cx
+            )
+            states = [states_0] + [
+                MultinodePenaltyFunctions.Functions._apply_mapping(
+                    states_mapping[i - 1].to_first, controllers[i].states[key].cx
+                )
+                for i in range(1, len(controllers))
+            ]
+            for states_i in states[1:]:
                 if states_0.shape != states_i.shape:
                     raise RuntimeError(
                         f"Continuity can't be established since the number of x to be matched is {states_0.shape} in "
@@ -160,9 +211,7 @@ class MultinodePenaltyFunctions(PenaltyFunctionAbstract):
                         f"transition or supply states_mapping"
                     )
 
-                out += states_0 - states_i
-
-            return out
+            return MultinodePenaltyFunctions.Functions._difference(penalty, "states_equality", key, states, ctrl_0)
 
         @staticmethod
         def controls_equality(penalty, controllers: list[PenaltyController, ...], key: str = "all"):
@@ -184,12 +233,9 @@ class MultinodePenaltyFunctions(PenaltyFunctionAbstract):
             MultinodePenaltyFunctions.Functions._prepare_controller_cx(penalty, controllers)
 
             ctrl_0 = controllers[0]
-            controls_0 = ctrl_0.controls[key].cx
-            out = ctrl_0.cx.zeros(controls_0.shape)
-            for i in range(1, len(controllers)):
-                ctrl_i = controllers[i]
-                controls_i = ctrl_i.controls[key].cx
-
+            controls = [ctrl_i.controls[key].cx for ctrl_i in controllers]
+            controls_0 = controls[0]
+            for controls_i in controls[1:]:
                 if controls_0.shape != controls_i.shape:
                     raise RuntimeError(
                         f"Continuity can't be established since the number of x to be matched is {controls_0.shape} in "
@@ -197,9 +243,7 @@ class MultinodePenaltyFunctions(PenaltyFunctionAbstract):
                         f"multi_node"
                     )
 
-                out += controls_0 - controls_i
-
-            return out
+            return MultinodePenaltyFunctions.Functions._difference(penalty, "controls_equality", key, controls, ctrl_0)
 
         @staticmethod
         def algebraic_states_equality(
@@ -261,14 +305,10 @@ class MultinodePenaltyFunctions(PenaltyFunctionAbstract):
 
             MultinodePenaltyFunctions.Functions._prepare_controller_cx(penalty, controllers)
 
-            com_0 = controllers[0].model.center_of_mass(controllers[0].states["q"].cx)
-
-            out = controllers[0].cx.zeros((3, 1))
-            for i in range(1, len(controllers)):
-                com_i = controllers[i].model.center_of_mass(controllers[i].states["q"].cx)
-                out += com_0 - com_i
-
-            return out
+            com_equality = MultinodePenaltyFunctions.Functions._model_difference_function(
+                penalty, "com_equality", controllers, "center_of_mass", ("q",)
+            )
+            return com_equality(*[controller.states["q"].cx for controller in controllers])
 
         @staticmethod
         def com_velocity_equality(penalty, controllers: list[PenaltyController, ...]):
@@ -289,18 +329,12 @@ class MultinodePenaltyFunctions(PenaltyFunctionAbstract):
 
             MultinodePenaltyFunctions.Functions._prepare_controller_cx(penalty, controllers)
 
-            com_dot_0 = controllers[0].model.center_of_mass_velocity(
-                controllers[0].states["q"].cx, controllers[0].states["qdot"].cx
+            com_velocity_equality = MultinodePenaltyFunctions.Functions._model_difference_function(
+                penalty, "com_velocity_equality", controllers, "center_of_mass_velocity", ("q", "qdot")
+            )
+            return com_velocity_equality(
+                *[controller.states[key].cx for controller in controllers for key in ("q", "qdot")]
             )
-
-            out = controllers[0].cx.zeros((3, 1))
-            for i in range(1, len(controllers)):
-                com_dot_i = controllers[i].model.center_of_mass_velocity(
-                    controllers[i].states["q"].cx, controllers[i].states["qdot"].cx
-                )
-                out += com_dot_0 - com_dot_i
-
-            return out
 
         @staticmethod
         def time_equality(penalty, controllers: list[PenaltyController, PenaltyController]):
@@ -652,6 +686,328 @@ class MultinodePenaltyFunctions(PenaltyFunctionAbstract):
             for index, c in zip(indices, controllers):
                 c.cx_index_to_get = index
 
+        @staticmethod
+        def _functions_type(penalty) -> type:
+            """
+            Get the class that holds the options (use_sx, jit_options, codegen_directory and codegen_compiler) of a
+            penalty, that is the Functions class of its FcnEnum. The penalties built on another family of Functions
+            (e.g. the phase transitions) use the options of MultinodePenaltyFunctions
+
+            Parameters
+            ----------
+            penalty: MultinodePenalty
+                A reference to the penalty
+
+            Returns
+            -------
+            The MultinodePenaltyFunctions class (or child class) of the penalty
+            """
+
+            functions_type = penalty.type.get_type() if isinstance(penalty.type, FcnEnum) else None
+            if isinstance(functions_type, type) and issubclass(functions_type, MultinodePenaltyFunctions):
+                return functions_type
+            return MultinodePenaltyFunctions
+
+        @staticmethod
+        def _use_jit(penalty, cx: MX | SX) -> bool:
+            """
+            If the Functions of a penalty should be jit compiled. A jit compiled Function called on SX, or expanded
+            with the penalty (expand=True), is inlined in the graph, so jit=True is ignored with a warning in these cases
+
+            Parameters
+            ----------
+            penalty: MultinodePenalty
+                A reference to the penalty
+            cx: MX | SX
+                The type of casadi variable of the ocp
+
+            Returns
+            -------
+            If the penalty is declared with jit=True and the compiled Function is actually called
+            """
+
+            if not penalty.jit:
+                return False
+            if cx is SX or penalty.expand:
+                warn(
+                    f"jit=True is ignored for the multinode penalty {penalty.type.name} since its Functions are inlined "
+                    f"when {'the ocp uses SX' if cx is SX else 'expand=True'}"
+                )
+                return False
+            return True
+
+        @staticmethod
+        def _build_function(
+            penalty, name: str, inputs: list[MX | SX, ...], outputs: list[MX | SX, ...], jit: bool
+        ) -> Function:
+            """
+            Build the casadi Function of a penalty. If jit is True, the Function is jit compiled, or replaced by its
+            compiled counterpart if codegen_directory is set
+
+            Parameters
+            ----------
+            penalty: MultinodePenalty
+                A reference to the penalty
+            name: str
+                The name of the Function
+            inputs: list[MX | SX, ...]
+                The symbolic inputs of the Function
+            outputs: list[MX | SX, ...]
+                The outputs of the Function
+            jit: bool
+                If the Function should be compiled (see _use_jit)
+
+            Returns
+            -------
+            The Function
+            """
+
+            if not jit:
+                return Function(name, inputs, outputs)
+            functions_type = MultinodePenaltyFunctions.Functions._functions_type(penalty)
+            if functions_type.codegen_directory is None:
+                return Function(name, inputs, outputs, functions_type.jit_options)
+            return MultinodePenaltyFunctions.Functions._compile(penalty, Function(name, inputs, outputs))
+
+        @staticmethod
+        def _compile(penalty, function: Function) -> Function:
+            """
+            Generate the C code of a Function, compile it as a shared library in codegen_directory and load it back. The
+            library is named after a hash of the serialized Function, so an existing library is loaded without being
+            generated nor compiled again. The Jacobian, forward and reverse derivatives of the Function are compiled in
+            the same library so the solver can differentiate the loaded Function. The library is built in a private
+            temporary directory and then moved in place, so concurrent builds (e.g. MultiStart) never load a partially
+            written library. This is only reached when _use_jit is True, as an external Function can neither be called
+            on SX nor expanded
+
+            Parameters
+            ----------
+            penalty: MultinodePenalty
+                A reference to the penalty
+            function: Function
+                The Function to compile
+
+            Returns
+            -------
+            The external Function loaded from the library
+            """
+
+            functions_type = MultinodePenaltyFunctions.Functions._functions_type(penalty)
+            directory = functions_type.codegen_directory
+            library_name = f"{function.name()}_{hashlib.sha1(function.serialize().encode()).hexdigest()}"
+            library = os.path.join(directory, f"{library_name}.so")
+            if not os.path.isfile(library):
+                os.makedirs(directory, exist_ok=True)
+                with tempfile.TemporaryDirectory(dir=directory) as build_directory:
+                    code_generator = CodeGenerator(f"{library_name}.c")
+                    # The derivatives are generated as well, otherwise the external Function cannot be differentiated
+                    for generated_function in (function, function.jacobian(), function.forward(1), function.reverse(1)):
+                        code_generator.add(generated_function)
+                    code_generator.generate(os.path.join(build_directory, ""))
+                    built_library = os.path.join(build_directory, f"{library_name}.so")
+                    subprocess.run(
+                        [
+                            functions_type.codegen_compiler,
+                            *functions_type.jit_options.get("jit_options", {}).get("flags", ["-O3"]),
+                            "-fPIC",
+                            "-shared",
+                            os.path.join(build_directory, f"{library_name}.c"),
+                            "-o",
+                            built_library,
+                        ],
+                        check=True,
+                    )
+                    os.replace(built_library, library)
+            return external(function.name(), library)
+
+        @staticmethod
+        def _sum_of_differences(values: list[MX | SX, ...], cx: MX | SX) -> MX | SX:
+            """
+            Compute the sum of the differences between the first value and each of the others
+
+            Parameters
+            ----------
+            values: list[MX | SX, ...]
+                The values to compare, they must all have the same shape
+            cx: MX | SX
+                The type of casadi variable
+
+            Returns
+            -------
+            The sum(values[0] - values[i]) for i >= 1, computed as (n - 1) * values[0] - sum(values[i]) so the graph
+            holds a single reduction instead of a chain of additions. The common bi-node case is a plain subtraction
+            """
+
+            if len(values) < 2:
+                return cx.zeros(values[0].shape)
+            if len(values) == 2:
+                return values[0] - values[1]
+
+            others = horzcat(*[vec(value) for value in values[1:]])
+            return (len(values) - 1) * values[0] - reshape(sum2(others), values[0].shape)
+
+        @staticmethod
+        def _difference(
+            penalty, name: str, key: str, values: list[MX | SX, ...], controller: PenaltyController
+        ) -> MX | SX:
+            """
+            Compute the sum of the differences between the first value and each of the others. If use_sx is True, this
+            is done through an SX casadi Function, so the MX virtual machine is replaced by a flat scalar graph. If
+            the penalty is declared with jit=True, this Function is also jit compiled. Since this Function only
+            depends on the shape of the values, it is built once per ocp and reused by all the penalties of the same
+            Functions class that share them, through the casadi_func of the nlp of the first controller
+
+            Parameters
+            ----------
+            penalty: MultinodePenalty
+                A reference to the penalty
+            name: str
+                The name of the penalty function
+            key: str
+                The name of the variable the values are extracted from
+            values: list[MX | SX, ...]
+                The values to compare, they must all have the same shape
+            controller: PenaltyController
+                The first controller of the penalty
+
+            Returns
+            -------
+            The sum(values[0] - values[i]) for i >= 1
+            """
+
+            cx = controller.cx
+            functions_type = MultinodePenaltyFunctions.Functions._functions_type(penalty)
+            use_sx = functions_type.use_sx
+            jit = MultinodePenaltyFunctions.Functions._use_jit(penalty, cx)
+            if not use_sx and not jit:
+                return MultinodePenaltyFunctions.Functions._sum_of_differences(values, cx)
+
+            sym_type = SX if use_sx else cx
+            shapes = "_".join(f"{value.shape[0]}x{value.shape[1]}" for value in values)
+            # The Functions class is part of the name since the jit and codegen options are read on it
+            function_name = (
+                f"{name}_{key}_{shapes}_{sym_type.__name__}_{functions_type.__name__}{'_jit' if jit else ''}"
+            )
+            functions = controller.get_nlp.casadi_func
+            if function_name not in functions:
+                symbols = [sym_type.sym(f"{key}_{i}", *value.shape) for i, value in enumerate(values)]
+                functions[function_name] = MultinodePenaltyFunctions.Functions._build_function(
+                    penalty,
+                    name,
+                    symbols,
+                    [MultinodePenaltyFunctions.Functions._sum_of_differences(symbols, sym_type)],
+                    jit,
+                )
+            return functions[function_name](*values)
+
+        @staticmethod
+        def _model_difference_function(
+            penalty, name: str, controllers: list[PenaltyController, ...], model_function: str, keys: tuple[str, ...]
+        ) -> Function:
+            """
+            Get the Function that computes the sum of the differences between the value of a model function at the
+            first controller and at each of the others. The model function is expanded if the penalty is (expand=True)
+            or if the ocp uses SX, and mapped over the controllers of this penalty that belong to the same phase (e.g.
+            Node.START and Node.END of a same phase). This does not batch separate penalties, and when each controller
+            is in a different phase (the common case) it is a single call per controller. Since the Function only takes
+            the states in keys, its Jacobian does not touch the other states. The symbols and the Function are only
+            built once for a given set of phases, and are then stored in the casadi_func of the nlp of the first
+            controller
+
+            Parameters
+            ----------
+            penalty: MultinodePenalty
+                A reference to the penalty
+            name: str
+                The name of the penalty function
+            controllers: list[PenaltyController, ...]
+                The penalty node elements
+            model_function: str
+                The name of the model method to evaluate (e.g. "center_of_mass")
+            keys: tuple[str, ...]
+                The name of the states to send to the model method, in order
+
+            Returns
+            -------
+            The Function, its inputs being the states in keys for each of the controllers (controller-major)
+            """
+
+            nlp = controllers[0].get_nlp
+            cx = controllers[0].cx
+            jit = MultinodePenaltyFunctions.Functions._use_jit(penalty, cx)
+            # The Functions class is part of the name since the jit and codegen options are read on it
+            function_name = (
+                f"{name}_{'_'.join(str(controller.phase_idx) for controller in controllers)}"
+                f"_{MultinodePenaltyFunctions.Functions._functions_type(penalty).__name__}"
+            )
+            # An MX Function cannot be called on SX, so the model function is always expanded for an SX ocp
+            expand = penalty.expand or cx is SX
+            if expand:
+                function_name += "_expanded"
+            if jit:
+                function_name += "_jit"
+
+            if function_name not in nlp.casadi_func:
+                symbols = [
+                    [cx.sym(f"{key}_{i}", *controller.states[key].mx.shape) for key in keys]
+                    for i, controller in enumerate(controllers)
+                ]
+
+                # The controllers of a same phase share the same model, so the model function is mapped over all of them
+                controllers_per_phase = {}
+                for i, controller in enumerate(controllers):
+                    controllers_per_phase.setdefault(controller.phase_idx, []).append(i)
+
+                values = [None] * len(controllers)
+                for phase_controllers in controllers_per_phase.values():
+                    controller = controllers[phase_controllers[0]]
+                    # With expand=True, the model function is expanded so its sparsity is exact, as it only depends on the
+                    # states in keys. Otherwise, it is kept as an MX Function (e.g. for a model that cannot be expanded)
+                    model_symbols = [MX.sym(key, *controller.states[key].mx.shape) for key in keys]
+                    model_fcn = controller.to_casadi_func(
+                        model_function,
+                        getattr(controller.model, model_function),
+                        *model_symbols,
+                        expand=expand,
+                    )
+                    if len(phase_controllers) > 1:
+                        # Serial map, the model function is too small for threads to pay off their dispatch
+                        model_fcn = model_fcn.map(len(phase_controllers))
+
+                    model_values = model_fcn(
+                        *[horzcat(*[symbols[i][k] for i in phase_controllers]) for k in range(len(keys))]
+                    )
+                    for col, i in enumerate(phase_controllers):
+                        values[i] = model_values[:, col]
+
+                nlp.casadi_func[function_name] = MultinodePenaltyFunctions.Functions._build_function(
+                    penalty,
+                    name,
+                    [symbol for controller_symbols in symbols for symbol in controller_symbols],
+                    [MultinodePenaltyFunctions.Functions._sum_of_differences(values, cx)],
+                    jit,
+                )
+            return nlp.casadi_func[function_name]
+
+        @staticmethod
+        def _apply_mapping(mapping: Mapping, cx: MX | SX) -> MX | SX:
+            """
+            Apply a mapping to a casadi variable as a product with its constant sparse matrix
+
+            Parameters
+            ----------
+            mapping: Mapping
+                The mapping to apply
+            cx: MX | SX
+                The variable to map
+
+            Returns
+            -------
+            The mapped variable
+            """
+
+            return mapping.matrix(cx.shape[0]) @ cx
+
         @staticmethod
         def _prepare_states_mapping(controllers: list[PenaltyController, ...], states_mapping: list[BiMapping, ...]):
             """
@@ -768,11 +1124,11 @@ class MultinodePenaltyList(UniquePerPhaseOptionList):
         The list of all the multinode penalties prepared
         """
 
-        for mnc in self:
-            for phase in mnc.nodes_phase:
-                if phase < 0 or phase >= ocp.n_phases:
-                    raise ValueError("nodes_phase of the multinode_penalty must be between 0 and number of phases")
+        nodes_phase = np.array([phase for mnc in self for phase in mnc.nodes_phase])
+        if ((nodes_phase < 0) | (nodes_phase >= ocp.n_phases)).any():
+            raise ValueError("nodes_phase of the multinode_penalty must be between 0 and number of phases")
 
+        for mnc in self:
             node_names = [
                 f"P{phase}n{node.name if isinstance(node, Node) else node}, "
                 for node, phase in zip(mnc.nodes, mnc.nodes_phase)
@@ -154,7 +154,7 @@ class PenaltyHelpers:
         for phase_idx, node_idx, phase_dynamics, ns in zip(p.nodes_phase, p.multinode_idx, p.phase_dynamics, p.ns):
             # Fill the share_phase_nodes dict with the number of times a phase is used and the nodes used
             if phase_idx not in share_phase_nodes:
-                share_phase_nodes[phase_idx] = {"nodes_used": [], "available_cx": [0, 1, 2]}
+                share_phase_nodes[phase_idx] = {"nodes_used": set(), "available_cx": [0, 1, 2]}
 
             # If there is no more available, it means there is more than 3 nodes in a single phase which is not possible
             if not share_phase_nodes[phase_idx]["available_cx"]:
@@ -166,7 +166,7 @@ class PenaltyHelpers:
 
             if node_idx in share_phase_nodes[phase_idx]["nodes_used"]:
                 raise ValueError("It is not possible to constraints the same node twice")
-            share_phase_nodes[phase_idx]["nodes_used"].append(node_idx)
+            share_phase_nodes[phase_idx]["nodes_used"].add(node_idx)
 
             is_last_node = node_idx == ns
 
@@ -606,7 +606,7 @@ class PenaltyOption(OptionGeneric):
         self._check_sanity_of_penalty_interactions(controller)
 
         ocp = controller.ocp
-        penalty_idx = self.node_idx.index(controller.node_index)
+        penalty_idx = 0 if self.multinode_penalty else self.node_idx.index(controller.node_index)
 
         x = PenaltyHelpers.states(
             self,
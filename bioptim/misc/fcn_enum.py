@@ -3,11 +3,22 @@ from enum import Enum
 
 
 class FcnEnum(Enum):
+    def __init__(self, fcn, *args):
+        """
+        Keep the function of the member so it is not unpacked from the value at each call
+
+        Parameters
+        ----------
+        fcn: Callable
+            The function wrapped in the value of the member
+        """
+        self._fcn = fcn
+
     def __call__(self, *args, **kwargs):
         """
         Call the member.
         """
-        return self.value[0](*args, **kwargs)
+        return self._fcn(*args, **kwargs)
 
     @staticmethod
     @abstractmethod
@@ -22,11 +22,17 @@ class Mapping(OptionGeneric):
         The actual index list that links to the other set, an negative value links to a numerical 0
     oppose: list[int]
         Index to multiply by -1
+    _indices: tuple[list[int], list[int], list[int], list[int]]
+        The index of the positive and the negative values in the origin and in the new set (built on first use)
+    _matrices: dict
+        The sparse matrices equivalent to the mapping, for each size of origin set already requested
 
     Methods
     -------
     map(self, obj: list) -> list
         Apply the mapping to an obj
+    matrix(self, n_origin: int) -> DM
+        Get the mapping as a sparse matrix to multiply the obj with
     len(self) -> int
         Get the len of the mapping
     """
@@ -53,6 +59,34 @@ class Mapping(OptionGeneric):
                 oppose = [oppose]
             for i in oppose:
                 self.oppose[i] = -1
+        self._indices = None
+        self._matrices = {}
+
+    @property
+    def indices(self) -> tuple[list[int], list[int], list[int], list[int]]:
+        """
+        Get the index of the positive and the negative values in the origin and in the new set. Since map_idx and
+        oppose are not modified after the declaration, these lists are only built once
+
+        Returns
+        -------
+        index_plus_in_origin, index_plus_in_new, index_minus_in_origin, index_minus_in_new
+        """
+
+        if self._indices is None:
+            index_plus_in_origin = []
+            index_plus_in_new = []
+            index_minus_in_origin = []
+            index_minus_in_new = []
+            for i, v in enumerate(self.map_idx):
+                if v is not None and self.oppose[i] > 0:
+                    index_plus_in_origin.append(v)
+                    index_plus_in_new.append(i)
+                elif v is not None and self.oppose[i] < 0:
+                    index_minus_in_origin.append(v)
+                    index_minus_in_new.append(i)
+            self._indices = index_plus_in_origin, index_plus_in_new, index_minus_in_origin, index_minus_in_new
+        return self._indices
 
     def map(self, obj: tuple | list | np.ndarray | MX | SX | DM) -> np.ndarray | MX | SX | DM:
         """
@@ -81,22 +115,39 @@ class Mapping(OptionGeneric):
             raise RuntimeError("map must be applied on np.ndarray, MX or SX")
 
         # Fill the positive values
-        index_plus_in_origin = []
-        index_plus_in_new = []
-        index_minus_in_origin = []
-        index_minus_in_new = []
-        for i, v in enumerate(self.map_idx):
-            if v is not None and self.oppose[i] > 0:
-                index_plus_in_origin.append(v)
-                index_plus_in_new.append(i)
-            elif v is not None and self.oppose[i] < 0:
-                index_minus_in_origin.append(v)
-                index_minus_in_new.append(i)
+        index_plus_in_origin, index_plus_in_new, index_minus_in_origin, index_minus_in_new = self.indices
         mapped_obj[index_plus_in_new, :] = obj[index_plus_in_origin, :]  # Fill the non zeros values
         mapped_obj[index_minus_in_new, :] = -obj[index_minus_in_origin, :]  # Fill the non zeros values
 
         return mapped_obj
 
+    def matrix(self, n_origin: int) -> DM:
+        """
+        Get the mapping as a sparse matrix of +1 and -1, so that matrix(obj.shape[0]) @ obj equals map(obj). Multiplying
+        by a constant matrix keeps the selection visible to casadi, instead of a zero filled object that is assigned
+        row by row
+
+        Parameters
+        ----------
+        n_origin: int
+            The number of rows of the objects to map
+
+        Returns
+        -------
+        The (len(self), n_origin) sparse matrix
+        """
+
+        if n_origin not in self._matrices:
+            index_plus_in_origin, index_plus_in_new, index_minus_in_origin, index_minus_in_new = self.indices
+            self._matrices[n_origin] = DM.triplet(
+                [int(i) for i in index_plus_in_new + index_minus_in_new],
+                [int(i) for i in index_plus_in_origin + index_minus_in_origin],
+                DM([1] * len(index_plus_in_new) + [-1] * len(index_minus_in_new)),
+                len(self.map_idx),
+                n_origin,
+            )
+        return self._matrices[n_origin]
+
     def __len__(self) -> int:
         """
         Get the len of the mapping
@@ -132,6 +132,76 @@ class NonLinearProgram:
         Gives the time for a specific index
     """
 
+    # The attributes set through NonLinearProgram.add or by the dynamics configuration are declared here as well
+    __slots__ = (
+        "casadi_func",
+        "contact_forces_func",
+        "soft_contact_forces_func",
+        "control_type",
+        "cx",
+        "dt",
+        "dynamics",
+        "extra_dynamics",
+        "dynamics_evaluation",
+        "dynamics_func",
+        "implicit_dynamics_func",
+        "dynamics_type",
+        "external_forces",
+        "g",
+        "g_internal",
+        "g_implicit",
+        "J",
+        "J_internal",
+        "model",
+        "n_threads",
+        "ns",
+        "ode_solver",
+        "par_dynamics",
+        "phase_idx",
+        "phase_mapping",
+        "plot",
+        "plot_mapping",
+        "T",
+        "variable_mappings",
+        "u_bounds",
+        "u_init",
+        "U_scaled",
+        "u_scaling",
+        "U",
+        "use_states_from_phase_idx",
+        "use_controls_from_phase_idx",
+        "use_states_dot_from_phase_idx",
+        "x_bounds",
+        "x_init",
+        "X_scaled",
+        "x_scaling",
+        "X",
+        "a_bounds",
+        "a_init",
+        "A",
+        "A_scaled",
+        "a_scaling",
+        "phase_dynamics",
+        "time_index",
+        "time_cx",
+        "time_mx",
+        "dt_mx",
+        "tf",
+        "tf_mx",
+        "states",
+        "states_dot",
+        "controls",
+        "parameters",
+        "algebraic_states",
+        "integrated_values",
+        "dof_names",
+        "implicit_dynamics_func_first_node",
+        "implicit_dynamics_func_last_node",
+        "integrated_value_functions",
+        "is_stochastic",
+        "xdot_scaling",
+    )
+
     def __init__(self, phase_dynamics: PhaseDynamics):
         self.casadi_func = {}
         self.contact_forces_func = None
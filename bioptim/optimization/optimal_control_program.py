@@ -1535,8 +1535,9 @@ class OptimalControlProgram:
         dt_initial_guess = {}
         dt_cx = []
         dt_mx = []
+        phases_with_own_time = set(self.time_phase_mapping.to_first.map_idx)
         for i in range(self.n_phases):
-            if i in self.time_phase_mapping.to_first.map_idx:
+            if i in phases_with_own_time:
                 dt_cx.append(self.cx.sym(f"dt_phase_{i}", 1, 1))
                 dt_mx.append(MX.sym(f"dt_phase_{i}", 1, 1))
 
@@ -15,6 +15,15 @@ def test_mapping():
     np.testing.assert_almost_equal(Mapping([None, 0], oppose=1).map(obj_to_map), [[0, 0, 0], [0, -1, -2]])
 
 
+def test_mapping_matrix():
+    obj_to_map = np.array([[0, 1, 2], [3, 4, 5], [6, 7, 8], [9, 10, 11]])
+
+    for mapping in (Mapping([0, 2]), Mapping([None, 2, 1], oppose=[1, 2]), Mapping([None, 0], oppose=1)):
+        matrix = mapping.matrix(obj_to_map.shape[0])
+        assert matrix.shape == (len(mapping), obj_to_map.shape[0])
+        np.testing.assert_almost_equal(np.array(matrix) @ obj_to_map, mapping.map(obj_to_map))
+
+
 def test_bidirectional_mapping():
     mapping = BiMapping([0, 1, 2], [3, 4, 5])
 
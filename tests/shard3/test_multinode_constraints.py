@@ -1,10 +1,17 @@
 import re
+import shutil
+import subprocess
 
+import numpy as np
 import pytest
+from casadi import MX, Function, jacobian, vertcat, vec
 from bioptim import (
     BiorbdModel,
+    MultinodeConstraint,
     MultinodeConstraintList,
     MultinodeConstraintFcn,
+    MultinodeObjectiveList,
+    MultinodeObjectiveFcn,
     Node,
     OdeSolver,
     OptimalControlProgram,
@@ -13,11 +20,23 @@ from bioptim import (
     ObjectiveList,
     BoundsList,
     PhaseDynamics,
+    PenaltyController,
 )
+from bioptim.limits.multinode_constraint import MultinodeConstraintFunctions
 from tests.utils import TestUtils
 
 
-def prepare_ocp(biorbd_model_path, phase_1, phase_2, phase_dynamics) -> OptimalControlProgram:
+def prepare_ocp(
+    biorbd_model_path,
+    phase_1,
+    phase_2,
+    phase_dynamics,
+    use_sx: bool = False,
+    nodes: tuple[Node, Node] = (Node.START, Node.START),
+    multinode_constraints: MultinodeConstraintList = None,
+    multinode_objectives: MultinodeObjectiveList = None,
+    **constraint_options,
+) -> OptimalControlProgram:
     bio_model = (BiorbdModel(biorbd_model_path), BiorbdModel(biorbd_model_path), BiorbdModel(biorbd_model_path))
 
     # Problem parameters
@@ -34,22 +53,25 @@ def prepare_ocp(biorbd_model_path, phase_1, phase_2, phase_dynamics) -> OptimalC
     dynamics.add(DynamicsFcn.TORQUE_DRIVEN, expand_dynamics=True, phase_dynamics=phase_dynamics)
     dynamics.add(DynamicsFcn.TORQUE_DRIVEN, expand_dynamics=True, phase_dynamics=phase_dynamics)
 
-    multinode_constraints = MultinodeConstraintList()
+    multinode_constraints = MultinodeConstraintList() if multinode_constraints is None else multinode_constraints
     # hard constraint
     multinode_constraints.add(
         MultinodeConstraintFcn.STATES_EQUALITY,
         nodes_phase=(phase_1, phase_2),
-        nodes=(Node.START, Node.START),
+        nodes=nodes,
+        **constraint_options,
     )
     multinode_constraints.add(
         MultinodeConstraintFcn.COM_EQUALITY,
         nodes_phase=(phase_1, phase_2),
-        nodes=(Node.START, Node.START),
+        nodes=nodes,
+        **constraint_options,
     )
     multinode_constraints.add(
         MultinodeConstraintFcn.COM_VELOCITY_EQUALITY,
         nodes_phase=(phase_1, phase_2),
-        nodes=(Node.START, Node.START),
+        nodes=nodes,
+        **constraint_options,
     )
 
     # Path constraint
@@ -82,10 +104,30 @@ def prepare_ocp(biorbd_model_path, phase_1, phase_2, phase_dynamics) -> OptimalC
         u_bounds=u_bounds,
         objective_functions=objective_functions,
         multinode_constraints=multinode_constraints,
+        multinode_objectives=multinode_objectives,
         ode_solver=OdeSolver.RK4(),
+        use_sx=use_sx,
     )
 
 
+def evaluate_multinode_constraints(ocp: OptimalControlProgram, with_jacobian: bool = False) -> list[np.ndarray]:
+    np.random.seed(42)
+    values = []
+    for nlp in ocp.nlp:
+        for constraint in nlp.g_internal:
+            if isinstance(constraint, MultinodeConstraint):
+                function = constraint.function[constraint.node_idx[0]]
+                if with_jacobian:
+                    # The Jacobian of the constraint with respect to all of its inputs
+                    symbols = [MX.sym(f"input_{i}", *function.size_in(i)) for i in range(function.n_in())]
+                    function = Function(
+                        "jacobian", symbols, [jacobian(function(*symbols), vertcat(*[vec(s) for s in symbols]))]
+                    )
+                inputs = [np.random.random(function.size_in(i)) for i in range(function.n_in())]
+                values.append(np.array(function(*inputs)))
+    return values
+
+
 @pytest.mark.parametrize("node", [*Node, 0])
 def test_multinode_fail_first_node(node):
     # Constraints
@@ -156,3 +198,135 @@ def test_multinode_wrong_phase(phase_1, phase_2, phase_dynamics):
             prepare_ocp(model, phase_1, phase_2, phase_dynamics=phase_dynamics)
     else:
         prepare_ocp(model, phase_1, phase_2, phase_dynamics=phase_dynamics)
+
+
+@pytest.mark.skipif(shutil.which("gcc") is None, reason="jit needs a C compiler")
+def test_multinode_jit():
+    model = TestUtils.bioptim_folder() + "/examples/getting_started/models/cube.bioMod"
+    phase_dynamics = PhaseDynamics.SHARED_DURING_THE_PHASE
+
+    expected = evaluate_multinode_constraints(prepare_ocp(model, 0, 2, phase_dynamics=phase_dynamics))
+    values = evaluate_multinode_constraints(prepare_ocp(model, 0, 2, phase_dynamics=phase_dynamics, jit=True))
+
+    assert len(values) == len(expected) == 3
+    for value, expected_value in zip(values, expected):
+        np.testing.assert_almost_equal(value, expected_value)
+
+
+@pytest.mark.parametrize("use_sx, expand", [(True, False), (False, True)])
+def test_multinode_jit_ignored(use_sx, expand):
+    model = TestUtils.bioptim_folder() + "/examples/getting_started/models/cube.bioMod"
+    phase_dynamics = PhaseDynamics.SHARED_DURING_THE_PHASE
+
+    with pytest.warns(UserWarning, match="jit=True is ignored for the multinode penalty STATES_EQUALITY"):
+        prepare_ocp(model, 0, 2, phase_dynamics=phase_dynamics, use_sx=use_sx, jit=True, expand=expand)
+
+
+def test_multinode_use_sx(monkeypatch):
+    model = TestUtils.bioptim_folder() + "/examples/getting_started/models/cube.bioMod"
+    phase_dynamics = PhaseDynamics.SHARED_DURING_THE_PHASE
+
+    ocp = prepare_ocp(model, 0, 2, phase_dynamics=phase_dynamics)
+    assert any(name.startswith("states_equality_all_") for name in ocp.nlp[0].casadi_func)
+    expected = evaluate_multinode_constraints(ocp)
+
+    # The option is read on the Functions class of the constraints, not only on MultinodePenaltyFunctions
+    monkeypatch.setattr(MultinodeConstraintFunctions, "use_sx", False)
+    ocp = prepare_ocp(model, 0, 2, phase_dynamics=phase_dynamics)
+    assert not any(name.startswith("states_equality_all_") for name in ocp.nlp[0].casadi_func)
+    values = evaluate_multinode_constraints(ocp)
+
+    assert len(values) == len(expected) == 3
+    for value, expected_value in zip(values, expected):
+        np.testing.assert_almost_equal(value, expected_value)
+
+
+@pytest.mark.skipif(shutil.which("gcc") is None, reason="codegen needs a C compiler")
+def test_multinode_codegen(monkeypatch, tmp_path):
+    model = TestUtils.bioptim_folder() + "/examples/getting_started/models/cube.bioMod"
+    phase_dynamics = PhaseDynamics.SHARED_DURING_THE_PHASE
+
+    ocp = prepare_ocp(model, 0, 2, phase_dynamics=phase_dynamics)
+    expected = evaluate_multinode_constraints(ocp)
+    expected_jacobians = evaluate_multinode_constraints(ocp, with_jacobian=True)
+
+    monkeypatch.setattr(MultinodeConstraintFunctions, "codegen_directory", str(tmp_path))
+    compilations = []
+    run = subprocess.run
+
+    def counted_run(*args, **kwargs):
+        compilations.append(args[0])
+        return run(*args, **kwargs)
+
+    monkeypatch.setattr(subprocess, "run", counted_run)
+
+    ocp = prepare_ocp(model, 0, 2, phase_dynamics=phase_dynamics, jit=True)
+    values = evaluate_multinode_constraints(ocp)
+    # The derivatives are compiled in the libraries, otherwise the loaded Functions could not be differentiated
+    jacobians = evaluate_multinode_constraints(ocp, with_jacobian=True)
+    libraries = sorted(tmp_path.iterdir())
+    assert len(libraries) == len(compilations) > 0
+    assert all(library.suffix == ".so" for library in libraries)
+
+    # The libraries are found by their hash, so a second build does not compile again
+    values_reused = evaluate_multinode_constraints(prepare_ocp(model, 0, 2, phase_dynamics=phase_dynamics, jit=True))
+    assert sorted(tmp_path.iterdir()) == libraries
+    assert len(compilations) == len(libraries)
+
+    assert len(values) == len(values_reused) == len(expected) == 3
+    for value, value_reused, expected_value in zip(values, values_reused, expected):
+        np.testing.assert_almost_equal(value, expected_value)
+        np.testing.assert_almost_equal(value_reused, expected_value)
+    for jacobian_value, expected_jacobian in zip(jacobians, expected_jacobians):
+        np.testing.assert_almost_equal(jacobian_value, expected_jacobian)
+
+
+def test_multinode_functions_per_class():
+    model = TestUtils.bioptim_folder() + "/examples/getting_started/models/cube.bioMod"
+    phase_dynamics = PhaseDynamics.SHARED_DURING_THE_PHASE
+
+    multinode_objectives = MultinodeObjectiveList()
+    multinode_objectives.add(
+        MultinodeObjectiveFcn.STATES_EQUALITY, nodes_phase=(0, 2), nodes=(Node.START, Node.START), weight=1
+    )
+    ocp = prepare_ocp(model, 0, 2, phase_dynamics=phase_dynamics, multinode_objectives=multinode_objectives)
+
+    # The options are read on the Functions class, so the constraint and the objective must not share a Function
+    names = [name for name in ocp.nlp[0].casadi_func if name.startswith("states_equality_all_")]
+    assert any("MultinodeConstraintFunctions" in name for name in names)
+    assert any("MultinodeObjectiveFunctions" in name for name in names)
+
+
+def custom_com_difference(controllers: list[PenaltyController, ...]) -> MX:
+    # The com of each node is computed separately, without mapping the model function over the controllers
+    com = [controller.model.center_of_mass(controller.states["q"].cx) for controller in controllers]
+    return com[0] - com[1]
+
+
+def test_multinode_com_same_phase():
+    model = TestUtils.bioptim_folder() + "/examples/getting_started/models/cube.bioMod"
+
+    multinode_constraints = MultinodeConstraintList()
+    multinode_constraints.add(custom_com_difference, nodes_phase=(0, 0), nodes=(Node.START, Node.END))
+    # More than 3 multinode constraints on the same phase needs a dynamics per node
+    ocp = prepare_ocp(
+        model,
+        0,
+        0,
+        phase_dynamics=PhaseDynamics.ONE_PER_NODE,
+        nodes=(Node.START, Node.END),
+        multinode_constraints=multinode_constraints,
+    )
+
+    functions = {
+        constraint.type: constraint.function[constraint.node_idx[0]]
+        for constraint in ocp.nlp[0].g_internal
+        if isinstance(constraint, MultinodeConstraint)
+    }
+    com_function = functions[MultinodeConstraintFcn.COM_EQUALITY]
+    expected_function = functions[MultinodeConstraintFcn.CUSTOM]
+    assert com_function.n_in() == expected_function.n_in()
+
+    np.random.seed(42)
+    inputs = [np.random.random(com_function.size_in(i)) for i in range(com_function.n_in())]
+    np.testing.assert_almost_equal(np.array(com_function(*inputs)), np.array(expected_function(*inputs)))